@@ -10,6 +10,13 @@ def main():
         ]
         f = Formatter(statements, mode=Formatting.HUMAN)
         print(f.format_table())
+
+        # Sub-statements can be evaluated on their own, including single variables
+        var_table = {"A": True, "B": False, "C": False}
+        for statement in statements:
+            for sub in (statement.left, statement.right):
+                if sub is not None:
+                    print(f"{sub.literal} = {sub(var_table)}")
     except MalformedExpressionError as e:
         print(e)
 
@@ -1,3 +1,4 @@
+import operator
 from enum import Enum, IntEnum, auto
 from typing import Callable
 
@@ -17,18 +18,53 @@ class Operator(IntEnum):
     EQUIVALENT = auto()
 
 
+class TokenKind(IntEnum):
+    OPERATOR = auto()
+    VARIABLE = auto()
+    LPAREN = auto()
+    RPAREN = auto()
+    OTHER = auto()
+
+
+# On bools, the builtin operators compute the same values as the logical operators,
+# e.g. implication is false only for True <= False
 UNARY_OPERATORS: dict[Operator, Callable[[bool], bool]] = {
-    Operator.NONE: lambda a: a,
-    Operator.NOT: lambda a: not a,
+    Operator.NONE: operator.truth,
+    Operator.NOT: operator.not_,
 }
 
 BINARY_OPERATORS: dict[Operator, Callable[[bool, bool], bool]] = {
-    Operator.AND: lambda a, b: a and b,
-    Operator.OR: lambda a, b: a or b,
-    Operator.IMPLIES: lambda a, b: (not a) or b,
-    Operator.EQUIVALENT: lambda a, b: a == b,
+    Operator.AND: operator.and_,
+    Operator.OR: operator.or_,
+    Operator.IMPLIES: operator.le,
+    Operator.EQUIVALENT: operator.eq,
+}
+
+# Operators on bitvectors, i.e. ints whose bits hold the truth values of all rows of a
+# truth table at once. The second/third argument is a mask with one bit set per row.
+# Operands never have bits outside of the mask, so negation is a single XOR with it.
+UNARY_BITVECTOR_OPERATORS: dict[Operator, Callable[[int, int], int]] = {
+    Operator.NONE: lambda a, mask: a,
+    Operator.NOT: lambda a, mask: a ^ mask,
 }
 
+BINARY_BITVECTOR_OPERATORS: dict[Operator, Callable[[int, int, int], int]] = {
+    Operator.AND: lambda a, b, mask: a & b,
+    Operator.OR: lambda a, b, mask: a | b,
+    Operator.IMPLIES: lambda a, b, mask: (a ^ mask) | b,
+    Operator.EQUIVALENT: lambda a, b, mask: a ^ b ^ mask,
+}
+
+
+# Python expressions equivalent to the operators, used to generate evaluation functions
+OPERATOR_TO_PYTHON: dict[Operator, str] = {
+    Operator.NONE: "{right}",
+    Operator.NOT: "(not {right})",
+    Operator.AND: "({left} and {right})",
+    Operator.OR: "({left} or {right})",
+    Operator.IMPLIES: "((not {left}) or {right})",
+    Operator.EQUIVALENT: "({left} == {right})",
+}
 
 OPERATOR_TO_STR: dict[Formatting, dict[Operator, str]] = {
     Formatting.HUMAN: {
@@ -8,8 +8,8 @@ from .common import (
     BOOL_FORMAT,
     Formatting,
 )
-from .statement import Statement
-from .util import table_to_str
+from .statement import Statement, compile_statements, run_compiled
+from .util import table_to_lines, unpack_bitvector, variable_bitvectors
 
 
 class Formatter:
@@ -22,63 +22,83 @@ class Formatter:
     ) -> None:
         self.statements = statements
         self.mode = mode
-        variables = set().union(*[statement.variables for statement in statements])
-        self.variables = sorted(list(variables))
+        variables: set[str] = set()
+        for statement in statements:
+            variables |= statement.variables
+        self.variables = sorted(variables)
+        self._var_indices = {var: i for i, var in enumerate(self.variables)}
         self.bool_format = bool_format
         self.reverse = reverse
 
     def format_table(self):
-        statements = [Statement(var) for var in self.variables] + self.statements
-        n_cols = len(statements)
-        header = [
-            self.wrap_expression(statement.format(mode=self.mode))
-            for statement in statements
-        ]
-        table = [header]
+        n_cols = len(self.variables) + len(self.statements)
 
-        var_table = {var: False for var in self.variables}
-        values = range(2 ** len(self.variables))
-        if self.reverse:
-            values = reversed(values)
-        for i in values:
-            for j, var in enumerate(reversed(self.variables)):
-                var_table[var] = bool((i >> j) % 2)
-            table.append(
-                [
-                    self.wrap_expression(self.format_bool(statement(var_table)))
-                    for statement in statements
-                ]
-            )
+        var_bits, mask = variable_bitvectors(len(self.variables))
+        n_rows = mask.bit_length()
+        # Indexed by the 0/1 values unpacked from the bitvectors. Cells are wrapped for
+        # LaTeX as part of joining them into rows, see below
+        cell_strs = (self.format_bool(False), self.format_bool(True))
+        columns = [
+            self._variable_column(k, cell_strs) for k in range(len(self.variables))
+        ]
+        # Compiling all statements together evaluates shared sub-statements only once
+        ops, leaves, roots = compile_statements(self.statements)
+        indices = self._var_indices
+        results = run_compiled(
+            ops, [var_bits[indices[leaf.name]] for leaf in leaves], mask
+        )
+        # Identical statements share a slot, their cells only need to be formatted once
+        cells_by_root: dict[int, list[str]] = {}
+        for statement, root in zip(self.statements, roots):
+            if root not in cells_by_root:
+                values = unpack_bitvector(results[root], n_rows)
+                if self.reverse:
+                    values.reverse()
+                cells_by_root[root] = list(map(cell_strs.__getitem__, values))
+            column = [statement.format(mode=self.mode)]
+            column.extend(cells_by_root[root])
+            columns.append(column)
 
-        output = ""
         match self.mode:
             case Formatting.HUMAN:
                 col_delim = "   "
                 before_row = None
+                after_row = None
                 between_rows = None
             case Formatting.LATEX:
-                col_delim = LATEX_COLUMN_DELIM
-                before_row = LATEX_INDENT
+                # Closing and opening the wrap of adjacent cells around the delimiter
+                # wraps every cell without concatenating each one separately
+                col_delim = LATEX_WRAP_CHAR + LATEX_COLUMN_DELIM + LATEX_WRAP_CHAR
+                before_row = LATEX_INDENT + LATEX_WRAP_CHAR
+                after_row = LATEX_WRAP_CHAR
                 between_rows = LATEX_HLINE
 
             case _:
                 raise Exception("Exhaustive handling of Formatting in format_table()")
 
-        if self.mode == Formatting.LATEX:
-            output += LATEX_TABLE_PROLOGUE.format(columns="|".join("c" * n_cols)) + "\n"
-
-        output += table_to_str(
-            table,
+        lines = table_to_lines(
+            columns,
             col_delim,
             before_row,
             between_rows,
+            after_row=after_row,
             ljust=self.mode == Formatting.HUMAN,
         )
 
         if self.mode == Formatting.LATEX:
-            output += "\n" + LATEX_TABLE_EPILOGUE
+            lines.insert(0, LATEX_TABLE_PROLOGUE.format(columns="|".join("c" * n_cols)))
+            lines.append(LATEX_TABLE_EPILOGUE)
+
+        return "\n".join(lines)
 
-        return output
+    def _variable_column(self, k: int, cell_strs: tuple[str, str]) -> list[str]:
+        """Return the column of the k-th variable, which alternates between blocks of
+        2^(n - k - 1) false and true values"""
+        block = 1 << (len(self.variables) - k - 1)
+        false, true = reversed(cell_strs) if self.reverse else cell_strs
+        column = [self.variables[k]]
+        column.extend(([false] * block + [true] * block) * (1 << k))
+        return column
 
     def format_bool(self, value: bool) -> str:
         return self.bool_format[value]
@@ -1,23 +1,140 @@
 from __future__ import annotations
 
+import re
+from functools import lru_cache
 from string import ascii_uppercase
-from typing import Optional, Set
+from typing import Any, Callable, Optional
 
 from truthtables.common import (
+    BINARY_BITVECTOR_OPERATORS,
     BINARY_OPERATORS,
+    OPERATOR_TO_PYTHON,
     OPERATOR_TO_STR,
+    UNARY_BITVECTOR_OPERATORS,
     UNARY_OPERATORS,
     Formatting,
     Operator,
+    TokenKind,
     operator_macros,
 )
 from truthtables.exceptions import AmbiguousPrecedenceError, MalformedExpressionError
-from truthtables.util import split_tokens, unwrap_parentheses
+from truthtables.util import split_tokens
+
+# A single instruction of a compiled statement: (function, left slot, right slot).
+# Leaves have no function and load the variable at the row index in the right slot,
+# unary operators have no left slot (-1).
+CompiledOp = tuple[Optional[Callable[..., Any]], int, int]
+
+# A token of an expression together with its kind and, for operator macros, the
+# operator it stands for (Operator.NONE otherwise)
+Token = tuple[TokenKind, Operator, str]
+
+# Nodes created while parsing one statement: variables keyed by name, other
+# sub-statements by (literal, operator, left, right)
+NodeCache = dict[Any, "Statement"]
+
+# Longest macros first, so that e.g. "<=>" is not matched as "=>"
+MACRO_PATTERN = re.compile(
+    "|".join(
+        re.escape(macro) for macro in sorted(operator_macros, key=len, reverse=True)
+    )
+)
+MACRO_TO_STR: dict[Formatting, dict[str, str]] = {
+    mode: {macro: subst_table[op] for macro, op in operator_macros.items()}
+    for mode, subst_table in OPERATOR_TO_STR.items()
+}
+
+
+@lru_cache(maxsize=4096)
+def format_literal(literal: str, mode: Formatting) -> str:
+    """Substitute the symbols of `mode` for all operator macros in a literal in one pass.
+
+    Cached, since equal literals are often formatted by different Statements, e.g. when
+    the same expression is given to several Formatters."""
+    subst_table = MACRO_TO_STR[mode]
+    return MACRO_PATTERN.sub(lambda match: subst_table[match.group()], literal)
+
+
+def compile_statements(
+    statements: list[Statement],
+) -> tuple[list[CompiledOp], list[Variable], list[int]]:
+    """Flatten statement trees into a list of operations on bitvectors in postorder.
+
+    Every operation stores its result in the slot with its own index; operands refer
+    to the slots of earlier operations. Identical sub-statements, also across different
+    statements, share a single operation so that they are only evaluated once.
+    Also returns one leaf per distinct variable, in the order in which their values are
+    expected by `run_compiled`, and the slot holding the result of each statement."""
+    ops: list[CompiledOp] = []
+    leaves: list[Variable] = []
+    slots: dict[str | tuple[Operator, int, int], int] = {}
+
+    def visit(node: Statement) -> int:
+        if isinstance(node, Variable):
+            if node.name not in slots:
+                slots[node.name] = len(ops)
+                ops.append((None, -1, len(leaves)))
+                leaves.append(node)
+            return slots[node.name]
+        if node.left is None and node.operator == Operator.NONE:
+            return visit(node.right)
+
+        left = -1 if node.left is None else visit(node.left)
+        right = visit(node.right)
+        key = (node.operator, left, right)
+        if key not in slots:
+            slots[key] = len(ops)
+            if node.left is None:
+                ops.append((UNARY_BITVECTOR_OPERATORS[node.operator], -1, right))
+            else:
+                ops.append((BINARY_BITVECTOR_OPERATORS[node.operator], left, right))
+        return slots[key]
+
+    roots = [visit(statement) for statement in statements]
+    return ops, leaves, roots
+
+
+def run_compiled(ops: list[CompiledOp], row_values: list[Any], *args: Any) -> list[Any]:
+    """Run compiled statements on the values of their variables and return the values
+    of all slots.
+
+    Any additional arguments are passed on to every operator."""
+    results: list[Any] = []
+    append = results.append
+    for function, left, right in ops:
+        if function is None:
+            append(row_values[right])
+        elif left < 0:
+            append(function(results[right], *args))
+        else:
+            append(function(results[left], results[right], *args))
+    return results
+
+
+VARIABLE_NAMES = frozenset(ascii_uppercase)
 
 
 def is_valid_var_name(s: str) -> bool:
     # TODO: Consider extending the definition of a valid variable name
-    return s in ascii_uppercase
+    return s in VARIABLE_NAMES
+
+
+def classify_tokens(tokens: list[str]) -> list[Token]:
+    """Resolve the kind of every token in advance, so that the parser only has to
+    compare integers"""
+    typed: list[Token] = []
+    for token in tokens:
+        if token in operator_macros:
+            typed.append((TokenKind.OPERATOR, operator_macros[token], token))
+        elif is_valid_var_name(token):
+            typed.append((TokenKind.VARIABLE, Operator.NONE, token))
+        elif token == "(":
+            typed.append((TokenKind.LPAREN, Operator.NONE, token))
+        elif token == ")":
+            typed.append((TokenKind.RPAREN, Operator.NONE, token))
+        else:
+            typed.append((TokenKind.OTHER, Operator.NONE, token))
+    return typed
 
 
 class Statement:
@@ -35,23 +152,29 @@ class Statement:
     """
 
     def __init__(self, tokens: list[str] | str):
-        self.literal: str
-        self.operator: Operator
-        self.left: Optional[Statement]
-        self.right: Statement
-        self.variables: Set[str]
-
-        (
-            self.literal,
-            self.operator,
-            self.left,
-            self.right,
-            self.variables,
-        ) = self._parse_statement(tokens)
+        self._init(*self._parse_statement(tokens))
+
+    def _init(
+        self,
+        literal: str,
+        operator: Operator,
+        left: Optional[Statement],
+        right: Statement,
+        variables: frozenset[str],
+    ) -> None:
+        self.literal = literal
+        self.operator = operator
+        self.left = left
+        self.right = right
+        self.variables = variables
+        # Op list for evaluate_bitvector, see compile_statements
+        self._program: Optional[tuple[list[CompiledOp], list[Variable], int]] = None
+        self._compiled: Optional[Callable[[dict[str, bool]], bool]] = None
+        self._formatted: dict[Formatting, str] = {}
 
     def _parse_statement(
         self, tokens: list[str] | str
-    ) -> tuple[str, Operator, Optional[Statement], Statement, Set[str]]:
+    ) -> tuple[str, Operator, Optional[Statement], Statement, frozenset[str]]:
         """Returns a callable representing the literal expression and an
         integer representing the number of arguments.
 
@@ -60,7 +183,8 @@ class Statement:
         if isinstance(tokens, str):
             tokens = tokens.strip()
             if is_valid_var_name(tokens):
-                return tokens, Operator.NONE, None, Variable(tokens), {tokens}
+                variable = Variable(tokens)
+                return tokens, Operator.NONE, None, variable, variable.variables
             split = split_tokens(tokens)
             literal = tokens
         elif isinstance(tokens, list) and all(
@@ -72,104 +196,188 @@ class Statement:
             raise ValueError("'statements' must be str or list[str]")
 
         try:
-            return (literal, *self._parse_substatement(split))
+            node = parse_tokens(classify_tokens(split))
         except MalformedExpressionError as e:
             raise MalformedExpressionError(e.message, expression=literal)
-
-    def _parse_substatement(
-        self, tokens: list[str]
-    ) -> tuple[Operator, Optional[Statement], Statement, Set[str]]:
-        left: list[str] = []
-        right: list[str] = []
-        operator: Optional[Operator] = None
-
-        tokens = unwrap_parentheses(tokens)
-        # Find highest precedence operator
-        highest_prec = 0
-        highest_prec_index: Optional[int] = None
-        parenthesis_level = 0
-        n_vars = 0
-        for i, token in enumerate(tokens):
-            if token == "(":
-                parenthesis_level += 1
-                continue
-            elif token == ")":
-                parenthesis_level -= 1
-                continue
-            if parenthesis_level == 0 and token in operator_macros:
-                prec = operator_macros[token]
-                if highest_prec in [Operator.IMPLIES, Operator.EQUIVALENT] and prec in [
-                    Operator.IMPLIES,
-                    Operator.EQUIVALENT,
-                ]:
-                    raise AmbiguousPrecedenceError()
-                if prec > highest_prec:
-                    highest_prec = prec
-                    highest_prec_index = i
-            if is_valid_var_name(token):
-                n_vars += 1
-
-        if highest_prec_index is None:
-            # No operator found
-            if n_vars == 0:
-                raise MalformedExpressionError(
-                    f"No variables and no operator in expression: \"{' '.join(tokens)}\""
-                )
-            elif n_vars > 1:
-                raise MalformedExpressionError(
-                    f"Multiple variables but no operator in expression: \"{' '.join(tokens)}\""
-                )
-            if not is_valid_var_name(tokens[0]):
-                raise MalformedExpressionError(
-                    f"'{tokens}' doesn't contain a valid variable name."
-                )
-
-            return Operator.NONE, None, Variable(tokens[0]), {tokens[0]}
-
-        left = tokens[:highest_prec_index]
-        right = tokens[highest_prec_index + 1 :]
-        op_macro = tokens[highest_prec_index]
-
-        if len(left) > 0:
-            left_statement = Statement(unwrap_parentheses(left))
-        else:
-            left_statement = None
-        right_statement = Statement(unwrap_parentheses(right))
-
-        variables = (
-            right_statement.variables
-            if left_statement is None
-            else right_statement.variables.union(left_statement.variables)
-        )
-        operator = operator_macros[op_macro]
-        if left_statement is None and operator not in UNARY_OPERATORS.keys():
+        except RecursionError:
             raise MalformedExpressionError(
-                f"Non-unary operator '{op_macro}' in unary expression"
-            )
-        elif left_statement is not None and operator not in BINARY_OPERATORS.keys():
-            raise MalformedExpressionError(
-                f"Non-binary operator '{op_macro}' in binary expression"
+                "Expression is nested too deeply", expression=literal
             )
+        if isinstance(node, Variable):
+            return literal, Operator.NONE, None, node, node.variables
+        return literal, node.operator, node.left, node.right, node.variables
+
+    def _to_source(self) -> str:
+        """Return a Python expression evaluating the statement, with the values of the
+        variables looked up in `var_table`"""
+        return OPERATOR_TO_PYTHON[self.operator].format(
+            left=None if self.left is None else self.left._to_source(),
+            right=self.right._to_source(),
+        )
+
+    def _compile_lambda(self) -> Callable[[dict[str, bool]], bool]:
+        try:
+            return eval(f"lambda var_table: {self._to_source()}", {})
+        except (SyntaxError, RecursionError, MemoryError):
+            # Statements nested too deeply for the Python compiler
+            return self._evaluate_tree
+
+    def _evaluate_tree(self, var_table: dict[str, bool]) -> bool:
+        """Evaluate the statement by walking its tree. Like the generated functions, only
+        evaluates the right operand if the left one doesn't already decide the result."""
+        operator, left, right = self.operator, self.left, self.right
+        if operator == Operator.NONE:
+            return right._evaluate_tree(var_table)
+        if operator == Operator.NOT:
+            return not right._evaluate_tree(var_table)
 
-        return operator, left_statement, right_statement, variables
+        assert left is not None
+        if operator == Operator.AND:
+            return left._evaluate_tree(var_table) and right._evaluate_tree(var_table)
+        if operator == Operator.OR:
+            return left._evaluate_tree(var_table) or right._evaluate_tree(var_table)
+        if operator == Operator.IMPLIES:
+            if not left._evaluate_tree(var_table):
+                return True
+            return right._evaluate_tree(var_table)
+        return left._evaluate_tree(var_table) == right._evaluate_tree(var_table)
 
     def evaluate(self, var_table: dict[str, bool]) -> bool:
-        if self.left is None:
-            right = self.right.evaluate(var_table)
-            return UNARY_OPERATORS[self.operator](right)
-        else:
-            left = self.left.evaluate(var_table)
-            right = self.right.evaluate(var_table)
-            return BINARY_OPERATORS[self.operator](left, right)
+        if self._compiled is None:
+            self._compiled = self._compile_lambda()
+        return self._compiled(var_table)
 
     __call__ = evaluate
 
+    def evaluate_bitvector(self, var_bits: dict[str, int], mask: int) -> int:
+        """Evaluate the statement for all rows of a truth table at once.
+
+        Each variable's value is given by name as a bitvector holding one bit per row,
+        `mask` has all of those bits set. Returns the bitvector of the statement's
+        values."""
+        if self._program is None:
+            ops, leaves, (root,) = compile_statements([self])
+            self._program = ops, leaves, root
+        ops, leaves, root = self._program
+        row_values = [var_bits[leaf.name] for leaf in leaves]
+        return run_compiled(ops, row_values, mask)[root]
+
     def format(self, mode=Formatting.HUMAN):
-        literal = self.literal
-        subst_table = OPERATOR_TO_STR[mode]
-        for macro, subst in operator_macros.items():
-            literal = literal.replace(macro, subst_table[subst])
-        return literal
+        if mode not in self._formatted:
+            self._formatted[mode] = format_literal(self.literal, mode)
+        return self._formatted[mode]
+
+
+def make_statement(
+    nodes: NodeCache,
+    literal: str,
+    operator: Operator,
+    left: Optional[Statement],
+    right: Statement,
+) -> Statement:
+    """Create the node of a sub-statement, or return the one created earlier in the same
+    parse for an identical sub-statement. Operands are shared already, so looking them
+    up by identity is enough."""
+    key = (literal, operator, left, right)
+    if key in nodes:
+        return nodes[key]
+    statement = Statement.__new__(Statement)
+    # Operands often have the same variables, e.g. when they are the same shared node,
+    # in which case the set can be reused as is
+    if left is None or left.variables is right.variables:
+        variables = right.variables
+    else:
+        variables = left.variables | right.variables
+    statement._init(literal, operator, left, right, variables)
+    nodes[key] = statement
+    return statement
+
+
+def make_variable(nodes: NodeCache, name: str) -> Statement:
+    if name not in nodes:
+        nodes[name] = Variable(name)
+    return nodes[name]
+
+
+def parse_tokens(tokens: list[Token]) -> Statement:
+    """Parse classified tokens into a tree of sub-statements by precedence climbing,
+    advancing through the tokens only once.
+
+    Sub-statements which occur repeatedly within the statement share their node."""
+    node, pos = _parse_expression(tokens, 0, Operator.EQUIVALENT, {})
+    if pos < len(tokens):
+        # The expression can only end early at a closing parenthesis
+        raise MalformedExpressionError("Unbalanced parentheses")
+    return node
+
+
+def _parse_expression(
+    tokens: list[Token], pos: int, loosest: Operator, nodes: NodeCache
+) -> tuple[Statement, int]:
+    """Parse the longest expression starting at `pos` whose binary operators bind at
+    least as tightly as `loosest`. Returns the expression and the position after it.
+
+    Binary operators are right-associative, except for implication and equivalence
+    which may not follow each other at the same level of parentheses."""
+    start = pos
+    node, pos = _parse_operand(tokens, pos, nodes)
+    chained = False
+    while pos < len(tokens):
+        kind, operator, text = tokens[pos]
+        if kind == TokenKind.RPAREN:
+            break
+        if kind != TokenKind.OPERATOR:
+            raise MalformedExpressionError(f"Missing operator before '{text}'")
+        if operator not in BINARY_OPERATORS:
+            raise MalformedExpressionError(
+                f"Non-binary operator '{text}' in binary expression"
+            )
+        if operator > loosest:
+            break
+
+        # Implication and equivalence are the two lowest precedences
+        if operator >= Operator.IMPLIES:
+            if chained:
+                raise AmbiguousPrecedenceError()
+            chained = True
+            right, pos = _parse_expression(tokens, pos + 1, Operator.OR, nodes)
+        else:
+            right, pos = _parse_expression(tokens, pos + 1, operator, nodes)
+        literal = _join_tokens(tokens, start, pos)
+        node = make_statement(nodes, literal, operator, node, right)
+    return node, pos
+
+
+def _parse_operand(
+    tokens: list[Token], pos: int, nodes: NodeCache
+) -> tuple[Statement, int]:
+    """Parse a variable, a parenthesized expression or a unary operator applied to an
+    operand. Returns the operand and the position after it."""
+    if pos == len(tokens):
+        raise MalformedExpressionError("Missing operand at the end of the expression")
+    kind, operator, text = tokens[pos]
+    if kind == TokenKind.VARIABLE:
+        return make_variable(nodes, text), pos + 1
+    if kind == TokenKind.LPAREN:
+        node, pos = _parse_expression(tokens, pos + 1, Operator.EQUIVALENT, nodes)
+        if pos == len(tokens):
+            raise MalformedExpressionError("Unbalanced parentheses")
+        return node, pos + 1
+    if kind == TokenKind.OPERATOR:
+        if operator not in UNARY_OPERATORS:
+            raise MalformedExpressionError(
+                f"Non-unary operator '{text}' in unary expression"
+            )
+        right, end = _parse_operand(tokens, pos + 1, nodes)
+        literal = _join_tokens(tokens, pos, end)
+        return make_statement(nodes, literal, operator, None, right), end
+    if kind == TokenKind.RPAREN:
+        raise MalformedExpressionError("Missing operand before ')'")
+    raise MalformedExpressionError(f"'{text}' is neither a variable nor an operator")
+
+
+def _join_tokens(tokens: list[Token], start: int, stop: int) -> str:
+    return " ".join([tokens[i][2] for i in range(start, stop)])
 
 
 class Variable(Statement):
@@ -177,6 +385,22 @@ class Variable(Statement):
 
     def __init__(self, name: str):
         self.name = name
+        # A Variable can stand in for the Statement consisting of just its name
+        self.literal = name
+        self.operator = Operator.NONE
+        self.left = None
+        self.right = self
+        self.variables = frozenset((name,))
+        self._formatted = {mode: name for mode in Formatting}
 
     def evaluate(self, var_table: dict[str, bool]) -> bool:
         return var_table[self.name]
+
+    __call__ = evaluate
+    _evaluate_tree = evaluate
+
+    def _to_source(self) -> str:
+        return f"var_table[{self.name!r}]"
+
+    def evaluate_bitvector(self, var_bits: dict[str, int], mask: int) -> int:
+        return var_bits[self.name]
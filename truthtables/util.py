@@ -1,44 +1,100 @@
-from typing import Optional
+import re
+from functools import lru_cache
+from itertools import chain
+from typing import Callable, Optional
+
+
+# Parentheses are tokens on their own, everything else is separated by spaces
+TOKEN_PATTERN = re.compile(r"[()]|[^ ()]+")
 
 
 def split_tokens(literal: str) -> list[str]:
-    tokens = []
-    accumulator = ""
-    for char in literal:
-        if char in [" ", "(", ")"]:
-            if accumulator:
-                tokens.append(accumulator)
-                accumulator = ""
-            if char != " ":
-                tokens.append(char)
-        else:
-            accumulator += char
-    if accumulator:
-        tokens.append(accumulator)
-
-    return tokens
-
-
-def unwrap_parentheses(literal: list[str]) -> list[str]:
-    stack = []
-    level = 0
-    for char in literal:
-        match char:
-            case "(":
-                stack.append(level)
-                level += 1
-            case ")":
-                level -= 1
-                stack.append(level)
-    while literal[0] == "(":
-        if literal[-1] != ")":
-            break
-        if stack[0] in stack[1:-1]:
-            break
-        stack = stack[1:-1]
-        literal = literal[1:-1]
-
-    return literal
+    return TOKEN_PATTERN.findall(literal)
+
+
+@lru_cache(maxsize=16)
+def variable_bitvectors(n_vars: int) -> tuple[tuple[int, ...], int]:
+    """Return the bitvectors of `n_vars` variables over all 2^n_vars rows of a truth
+    table together with the mask of all rows.
+
+    Row i is stored in bit 2^n_vars - 1 - i, so the most significant bit holds the first
+    row. Rows are counted in binary with the first variable being the most significant,
+    e.g. for two variables the bitvectors are 0b0011 and 0b0101.
+
+    The bitvector of variable k is mask // (2^(2^(n_vars - k - 1)) + 1). Rather than
+    dividing big ints, each one is built by doubling a block of 2^(n_vars - k - 1) ones
+    until it covers all rows.
+
+    Cached, since the bitvectors only depend on the number of variables."""
+    n_rows = 1 << n_vars
+    bitvectors = []
+    for k in range(n_vars):
+        length = 1 << (n_vars - k - 1)
+        bits = (1 << length) - 1
+        length <<= 1
+        while length < n_rows:
+            bits |= bits << length
+            length <<= 1
+        bitvectors.append(bits)
+    return tuple(bitvectors), (1 << n_rows) - 1
+
+
+BINARY_DIGITS_TO_BYTES = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def unpack_bitvector(bits: int, n_rows: int) -> list[int]:
+    """Unpack a bitvector as returned by `Statement.evaluate_bitvector` into one value
+    per row, 0 for false and 1 for true"""
+    return list(format(bits, f"0{n_rows}b").encode().translate(BINARY_DIGITS_TO_BYTES))
+
+
+# Functions padding a cell to the width of its column
+ALIGNMENTS: dict[str, Callable[[str, int], str]] = {
+    "l": str.ljust,
+    "r": str.rjust,
+    "c": str.center,
+}
+
+
+def table_to_lines(
+    columns: list[list[str]],
+    col_delim: str,
+    before_row: Optional[str],
+    between_rows: Optional[str],
+    after_row: Optional[str] = None,
+    ljust: bool = False,
+    align: Optional[list[str]] = None,
+) -> list[str]:
+    """Format a table given as a list of columns, one line per row with `between_rows`
+    on a separate line between consecutive rows.
+
+    `align` gives the alignment of each column, one of "l", "r" or "c" (see `ALIGNMENTS`),
+    and takes precedence over `ljust`, which left-aligns all columns."""
+    if align is None and ljust:
+        align = ["l"] * len(columns)
+    if align is not None:
+        if len(align) != len(columns):
+            raise ValueError("'align' must have one entry per column")
+        try:
+            pads = [ALIGNMENTS[a] for a in align]
+        except KeyError as e:
+            raise ValueError(f"Unknown alignment {e.args[0]!r}") from None
+        columns = [_pad_column(column, pad) for column, pad in zip(columns, pads)]
+    before_row = before_row if before_row is not None else ""
+    after_row = after_row if after_row is not None else ""
+    rows = [before_row + col_delim.join(row) + after_row for row in zip(*columns)]
+
+    if between_rows is None or not rows:
+        return rows
+    return [rows[0], *chain.from_iterable((between_rows, row) for row in rows[1:])]
+
+
+def _pad_column(column: list[str], pad: Callable[[str, int], str]) -> list[str]:
+    """Pad all elements of a column to the same width. Columns hold only a few distinct
+    elements, so each of them is padded once and then looked up."""
+    width = max(map(len, column))
+    padded = {el: pad(el, width) for el in set(column)}
+    return list(map(padded.__getitem__, column))
 
 
 def table_to_str(
@@ -47,19 +103,19 @@ def table_to_str(
     before_row: Optional[str],
     between_rows: Optional[str],
     ljust: bool = False,
+    after_row: Optional[str] = None,
+    align: Optional[list[str]] = None,
 ) -> str:
-    col_widths = [
-        max([len(table[row][col]) for row in range(len(table))])
-        for col in range(len(table[0]))
-    ]
-    rows = []
-    for row in table:
-        row_str = before_row if before_row is not None else ""
-        elements = [
-            el.ljust(col_widths[j]) if ljust else el for j, el in enumerate(row)
-        ]
-        row_str += col_delim.join(elements)
-        rows.append(row_str)
-
-    glue = f"\n{between_rows}\n" if between_rows is not None else "\n"
-    return glue.join(rows)
+    """Join a table given as a list of rows into a string, see `table_to_lines`"""
+    columns = [list(column) for column in zip(*table)]
+    return "\n".join(
+        table_to_lines(
+            columns,
+            col_delim,
+            before_row,
+            between_rows,
+            after_row,
+            ljust=ljust,
+            align=align,
+        )
+    )